@@ -14,7 +14,6 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import inspect
 from xdis import findlinestarts
 import json
 
@@ -23,6 +22,44 @@ from trepan.lib.disassemble import disassemble_bytes
 import trepan.lib.stack as Mstack
 import linecache
 
+
+# Line tables, reused across frames and across `info pc` calls. Code
+# objects compare by value (ignoring the line table on some Pythons), so
+# entries are keyed on id() and hold their code object, which keeps that
+# id from being reused. The size bound limits how many debuggee code
+# objects this keeps alive.
+_LINESTARTS_CACHE_SIZE = 128
+_linestarts_cache = {}
+
+
+def _linestarts(code):
+    """Return the offset -> line number table for `code`.
+
+    The returned dict is shared and must not be modified."""
+    entry = _linestarts_cache.get(id(code))
+    if entry is not None and entry[0] is code:
+        return entry[1]
+    if len(_linestarts_cache) >= _LINESTARTS_CACHE_SIZE:
+        # Drop the oldest entry.
+        del _linestarts_cache[next(iter(_linestarts_cache))]
+    linestarts = {offset: line for offset, line in findlinestarts(code)}
+    _linestarts_cache[id(code)] = (code, linestarts)
+    return linestarts
+
+
+# Values json can't encode are written as their repr().
+_LOCALS_ENCODER = json.JSONEncoder(indent=4, default=repr)
+
+
+def _safe_serialize(value):
+    """Return `value` if it can be dumped as JSON, else its repr()."""
+    try:
+        _LOCALS_ENCODER.encode(value)
+        return value
+    except (TypeError, ValueError):
+        return repr(value)
+
+
 # FIXME: this could be combined with trepan3k's `info pc`, which doesn't
 # require a running program but uses use f_lasti.
 # What we have here is less desirable the presence of exceptions,
@@ -45,59 +82,106 @@ See also:
     need_stack = True
     short_help = "Show Program Counter or Instruction Offset information"
 
-    def generate_locals_dump(self, locals_dict):
-        def safe_serialize(value):
-            # Try to serialize the value; if it fails, use the repr of the value
-            try:
-                json.dumps(value)  # Test if JSON serializable
-                return value       # Return as-is if serializable
-            except (TypeError, ValueError):
-                return repr(value) # Use repr as fallback for non-serializable objects
-
-        # Create a new dictionary with serialized or repr values
-        safe_locals = {key: safe_serialize(value) for key, value in locals_dict.items()}
-        
-        # Convert the dictionary to a JSON string with pretty-printing
-        return json.dumps(safe_locals, indent=4)
+    # Everything in a frame entry up to the disassembly, which
+    # disassemble_bytes() writes itself.
+    _FRAME_TMPL = (
+        "[[[FrameEntry]]]\n"
+        "[[[FrameIndex]]] {count} [[[/FrameIndex]]]\n"
+        "[[[Filename]]] {file} [[[/Filename]]]\n"
+        "[[[Function]]] {fn} [[[/Function]]]\n"
+        "[[[LineNumber]]]\n{line_no}\n[[[/LineNumber]]]\n"
+        "[[[SourceLine]]]\n{line}\n[[[/SourceLine]]]\n"
+        "[[[PcOffset]]]\n{offset}\n[[[/PcOffset]]]\n"
+        "\n"
+        "[[[PythonBytecodes]]]\n"
+    )
 
+    def generate_locals_dump(self, locals_dict):
+        # Values json can't encode are written as their repr(), in the same
+        # pass that serializes everything else.
+        try:
+            return _LOCALS_ENCODER.encode(locals_dict)
+        except (TypeError, ValueError):
+            # Some value has non-string keys or a circular reference:
+            # repr() just the values that can't be dumped.
+            return _LOCALS_ENCODER.encode(
+                {key: _safe_serialize(value) for key, value in locals_dict.items()}
+            )
 
     def print_locals_in_all_frames(self, curframe, limit=None):
-        count = 0  # Initialize a counter to limit frames
-        
+        # Bind lookups used on every frame to locals once, up front.
+        msg_nocr = self.msg_nocr
         proc = self.proc
+        core = proc.core
+        opc = proc.vm.opc
+        frame2file = Mstack.frame2file
+        frame_tmpl = self._FRAME_TMPL
+
+        # A frame's output is collected here and written with a single
+        # msg_nocr() rather than one write per line.
+        out = []
+
+        def buf_msg(s):
+            out.append("%s\n" % (s,))
+
+        def buf_msg_nocr(s):
+            out.append("%s" % (s,))
+
+        # Gather the (at most `limit`) frames to show before doing any work.
+        frames = []
         frame = curframe
-        while frame is not None and (limit is None or count < limit):
-            print('[[[FrameEntry]]]')
-            print(f"[[[FrameIndex]]] {count} [[[/FrameIndex]]]")
-            #print(f"[[[FrameId]]] {id(frame)} [[[/FrameId]]]")
-            filename = Mstack.frame2file(self.proc.core, frame, canonic=False)
-            print(f"[[[Filename]]] {filename} [[[/Filename]]]")
-            print(f"[[[Function]]] {frame.f_code.co_name} [[[/Function]]]")
-            line_no = inspect.getlineno(frame)
-            line = linecache.getline(filename, line_no, frame.f_globals)
-
-            self.msg('[[[LineNumber]]]')
-            self.msg(line_no)
-            self.msg('[[[/LineNumber]]]')
-
-            self.msg('[[[SourceLine]]]')
-            self.msg(line)
-            self.msg('[[[/SourceLine]]]')
+        unlimited = limit is None
+        while frame is not None and (unlimited or len(frames) < limit):
+            frames.append(frame)
+            frame = frame.f_back
+
+        # Filenames of the code objects seen, for recursive frames sharing
+        # code. Keyed on id() since code objects compare by value, ignoring
+        # co_filename; `frames` keeps them all alive. The filename also
+        # depends on settings such as basename, so this lasts one call.
+        filenames = {}
+        # Source lines already fetched, by (filename, line_no).
+        source_lines = {}
+        # Names of the types seen among the locals, shared across frames.
+        type_names = {}
 
+        for count, frame in enumerate(frames):
+            code = frame.f_code
+            filename = filenames.get(id(code))
+            if filename is None:
+                filename = filenames[id(code)] = frame2file(
+                    core, frame, canonic=False
+                )
+
+            line_no = frame.f_lineno
+            # Pseudo-files like "<string>" have nothing linecache can read.
+            if filename and not filename.startswith("<"):
+                line_key = (filename, line_no)
+                line = source_lines.get(line_key)
+                if line is None:
+                    # f_globals lets linecache load through __loader__.
+                    line = source_lines[line_key] = linecache.getline(
+                        filename, line_no, frame.f_globals
+                    )
+            else:
+                line = ""
             offset = frame.f_lasti
-            self.msg('[[[PcOffset]]]')
-            self.msg(offset)
-            self.msg('[[[/PcOffset]]]')
-            self.msg('')
+
+            out.append(frame_tmpl.format_map({
+                "count": count,
+                "file": filename,
+                "fn": code.co_name,
+                "line_no": line_no,
+                "line": line,
+                "offset": offset,
+            }))
 
             offset = max(offset, 0)
-            code = frame.f_code
             co_code = code.co_code
 
-            self.msg('[[[PythonBytecodes]]]')
             disassemble_bytes(
-                self.msg,
-                self.msg_nocr,
+                buf_msg,
+                buf_msg_nocr,
                 code = co_code,
                 lasti = offset,
                 cur_line = line_no,
@@ -108,27 +192,40 @@ See also:
                 constants=code.co_consts,
                 cells=code.co_cellvars,
                 freevars=code.co_freevars,
-                linestarts=dict(findlinestarts(code)),
-                #end_offset=offset + 10,
+                linestarts=_linestarts(code),
+                # end_line already stops the walk past the lines shown.
                 end_offset=None,
-                opc=proc.vm.opc,
+                opc=opc,
             )
-            self.msg('[[[/PythonBytecodes]]]')
+            buf_msg('[[[/PythonBytecodes]]]')
 
-            locals_values = self.generate_locals_dump(frame.f_locals)
-            locals_types = { key: type(value).__name__ for key, value in frame.f_locals.items() }
-            print(f"[[[Locals]]]\n{self.generate_locals_dump(frame.f_locals)}\n[[[/Locals]]]")
-            print(f"[[[LocalsTypes]]]\n{self.generate_locals_dump(locals_types)}\n[[[/LocalsTypes]]]")
-            print('[[[/FrameEntry]]]')
-
-            # Move to the previous frame
-            frame = frame.f_back
-            count += 1
+            # Accessing f_locals can build a fresh dict each time; read it once.
+            flocals = frame.f_locals
+            locals_dump = self.generate_locals_dump(flocals)
+            locals_types = {}
+            for key, value in flocals.items():
+                value_type = type(value)
+                type_name = type_names.get(value_type)
+                if type_name is None:
+                    type_name = type_names[value_type] = value_type.__name__
+                locals_types[key] = type_name
+            buf_msg("[[[Locals]]]\n%s\n[[[/Locals]]]" % locals_dump)
+            buf_msg(
+                "[[[LocalsTypes]]]\n%s\n[[[/LocalsTypes]]]"
+                % json.dumps(locals_types, indent=4)
+            )
+            buf_msg('[[[/FrameEntry]]]')
+            msg_nocr("".join(out))
+            out.clear()
 
     def run(self, args, limit=5):
-        print('[[[InfoFrames]]]')
+        # Don't emit an empty [[[InfoFrames]]] envelope when there is
+        # nothing to show.
+        if limit == 0 or self.proc.curframe is None:
+            return False
+        self.msg('[[[InfoFrames]]]')
         self.print_locals_in_all_frames(self.proc.curframe, limit)
-        print('[[[/InfoFrames]]]')
+        self.msg('[[[/InfoFrames]]]')
 
     # def run(self, args):
     #     """Program counter."""